@@ -1,6 +1,10 @@
 import os
+import sys
 import json
+import argparse
 import sqlite3 as sql
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 # -- Fetch the Paths needed --
 
@@ -8,138 +12,245 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 db_dir = os.path.dirname(script_dir)
 
 db_file_path = os.path.join(db_dir, 'database.db')
+shards_dir = os.path.join(db_dir, 'shards')
 
 jsons_path = os.path.join(db_dir, 'jsons')
-JSON_DIR = os.path.join(jsons_path, 'lhir_json')
-print(JSON_DIR)
-json_to_parse = os.path.join(JSON_DIR, '2024-000052252 Silver Mountain Resources Inc-f1-06149229_2-1-1.json')
-
-
-# --- Load disk → RAM ---
-disk_conn = sql.connect(db_file_path)
-ram_conn = sql.connect(":memory:")
-disk_conn.backup(ram_conn)
-disk_conn.close()
-
-ram_conn.execute("""
-CREATE TABLE IF NOT EXISTS parameters (
-    parameter_id TEXT PRIMARY KEY,
-    parameter_desc TEXT,
-    conf_upper REAL,
-    conf_lower REAL,
-    prob_correct REAL,
-    samples_checked INTEGER
-);
-""")
-ram_conn.execute("""
-CREATE TABLE IF NOT EXISTS reports (
-    report_id TEXT PRIMARY KEY,
-    report_type TEXT,
-    sedar_year TEXT,
-    is_new BOOLEAN,
-    pages INTEGER
-);
-""")
-ram_conn.execute("""
-CREATE TABLE IF NOT EXISTS main (
-    report_id TEXT,
-    parameter_id TEXT,
-    value BLOB,
-    flagged BOOLEAN,
-    PRIMARY KEY (report_id, parameter_id),
-    FOREIGN KEY (report_id) REFERENCES reports(report_id),
-    FOREIGN KEY (parameter_id) REFERENCES parameters(parameter_id)
-);
-""")
-ram_conn.commit()
-
-def parse_params(json_to_parse):
-    with open(json_to_parse, "r", encoding="utf-8") as f:
+JSON_SUFFIX = '_json'
+
+# Derived parameters are defined in scripts/helpers/derived.py so the loader
+# and the analysis scripts share one implementation.
+sys.path.insert(0, os.path.join(os.path.dirname(db_dir), 'scripts'))
+from helpers.derived import DERIVED_INPUTS, DERIVED_PARAMS, derive_values
+
+def create_tables(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS parameters (
+        parameter_id TEXT PRIMARY KEY,
+        parameter_desc TEXT,
+        conf_upper REAL,
+        conf_lower REAL,
+        prob_correct REAL,
+        samples_checked INTEGER
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS reports (
+        report_id TEXT PRIMARY KEY,
+        report_type TEXT,
+        sedar_year TEXT,
+        is_new BOOLEAN,
+        pages INTEGER
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS main (
+        report_id TEXT,
+        parameter_id TEXT,
+        value BLOB,
+        flagged BOOLEAN,
+        PRIMARY KEY (report_id, parameter_id),
+        FOREIGN KEY (report_id) REFERENCES reports(report_id),
+        FOREIGN KEY (parameter_id) REFERENCES parameters(parameter_id)
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS derived_inputs (
+        report_id TEXT PRIMARY KEY,
+        inputs TEXT,
+        FOREIGN KEY (report_id) REFERENCES reports(report_id)
+    );
+    """)
+    conn.executemany(
+        "INSERT OR IGNORE INTO parameters (parameter_id, parameter_desc) VALUES (?, ?)",
+        DERIVED_PARAMS.items()
+    )
+    conn.commit()
+
+def find_json_files(report_types=None):
+    """
+    Returns (report_type, path) pairs for every extraction JSON.
+    Each report type lives in its own `jsons/<report_type>_json` directory.
+    """
+    files = []
+    for dirname in sorted(os.listdir(jsons_path)):
+        dir_pth = os.path.join(jsons_path, dirname)
+        if not (dirname.endswith(JSON_SUFFIX) and os.path.isdir(dir_pth)):
+            continue
+        report_type = dirname[:-len(JSON_SUFFIX)]
+        if report_types and report_type not in report_types:
+            continue
+        for filename in sorted(os.listdir(dir_pth)):
+            if filename.endswith('.json'):
+                files.append((report_type, os.path.join(dir_pth, filename)))
+    return files
+
+def read_sedar_year(file_pth):
+    with open(file_pth, "r", encoding='utf-8') as f:
         data = json.load(f)
+    return str(data.get("metadata", {}).get("sedar_year") or "unknown")
 
-    faf_section = data.get("faf", {})
+def insert_file(conn, file_pth, report_type):
+    """
+    Inserts the parameters, report row and values of one extraction JSON.
+    """
+    with open(file_pth, "r", encoding='utf-8') as f:
+        data = json.load(f)
+
+    metadata = data.get("metadata", {})
+    report_id_full = metadata.get("pdf_filename", "")
+    report_id, _ = os.path.splitext(report_id_full)
+    sedar_year = metadata.get("sedar_year")
+    pages = metadata.get("final_page_index")
+    is_new = 1 if metadata.get("43_101_era") == "new" else 0
+
+    conn.execute(
+        "INSERT OR REPLACE INTO reports (report_id, report_type, sedar_year, is_new, pages) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (report_id, report_type, sedar_year, is_new, pages)
+    )
 
+    faf_section = data.get("faf", {})
     for category_key in faf_section:
         category_data = faf_section[category_key]
 
         if "final_values" in category_data and isinstance(category_data["final_values"], dict):
             final_values = category_data["final_values"]
-            for param_key in final_values.keys():
-                ram_conn.execute(
+            for param_key, value in final_values.items():
+
+                insert_value = value
+                if isinstance(value, (dict, list)):
+                    insert_value = json.dumps(value)
+
+                conn.execute(
                     "INSERT OR IGNORE INTO parameters (parameter_id) VALUES (?)",
                     (param_key,)
                 )
-    ram_conn.commit()
+                conn.execute(
+                    "INSERT OR IGNORE INTO main (report_id, parameter_id, value, flagged) "
+                    "VALUES (?, ?, ?, ?)",
+                    (report_id, param_key, insert_value, 0)
+                )
 
-def parse_files(JSON_DIR):
-    for filename in os.listdir(JSON_DIR):
-        file_pth = os.path.join(JSON_DIR, filename)
-        with open(file_pth, "r", encoding='utf-8') as f:
-            data = json.load(f)
-
-            metadata = data.get("metadata", {})
-            report_id_full = metadata.get("pdf_filename", "")
-            report_id, _ = os.path.splitext(report_id_full)
-            sedar_year = metadata.get("sedar_year")
-            pages = metadata.get("final_page_index")
-            is_new = 1 if metadata.get("43_101_era") == "new" else 0
-
-            ram_conn.execute(
-                "INSERT OR REPLACE INTO reports (report_id, report_type, sedar_year, is_new, pages) "
-                "VALUES (?, ?, ?, ?, ?)",
-                (report_id, "lhir", sedar_year, is_new, pages)
-            )
-    ram_conn.commit()
+def update_derived_fields(conn):
+    """
+    Stores the derived parameters in `main` next to the raw ones. The inputs
+    used are recorded in `derived_inputs`, so reports whose inputs have not
+    changed since the last run are skipped.
+    """
+    placeholders = ", ".join("?" for _ in DERIVED_INPUTS)
+    inputs_by_report = defaultdict(dict)
+    for report_id, parameter_id, value in conn.execute(
+        f"SELECT report_id, parameter_id, value FROM main WHERE parameter_id IN ({placeholders})",
+        DERIVED_INPUTS
+    ):
+        inputs_by_report[report_id][parameter_id] = value
+    previous = dict(conn.execute("SELECT report_id, inputs FROM derived_inputs"))
+
+    derived_placeholders = ", ".join("?" for _ in DERIVED_PARAMS)
+    updated = 0
+    for report_id, inputs in inputs_by_report.items():
+        signature = json.dumps(inputs, sort_keys=True)
+        if previous.get(report_id) == signature:
+            continue
 
-def insert_data(JSON_DIR):
-    for filename in os.listdir(JSON_DIR):
-        file_pth = os.path.join(JSON_DIR, filename)
-        with open(file_pth, "r", encoding='utf-8') as f:
-            data = json.load(f)
-            
-            metadata = data.get("metadata", {})
-            report_id_full = metadata.get("pdf_filename", "")
-            report_id, _ = os.path.splitext(report_id_full)
-
-            faf_section = data.get("faf", {})
-            for category_key in faf_section:
-                category_data = faf_section[category_key]
-
-                if "final_values" in category_data and isinstance(category_data["final_values"], dict):
-                    final_values = category_data["final_values"]
-                    for param_key, value in final_values.items():
-                        
-                        insert_value = value
-                        if isinstance(value, (dict, list)):
-                            insert_value = json.dumps(value)
-
-                        ram_conn.execute(
-                            "INSERT OR IGNORE INTO main (report_id, parameter_id, value, flagged) "
-                            "VALUES (?, ?, ?, ?)",
-                            (report_id, param_key, insert_value, 0)
-                        )
+        conn.execute(
+            f"DELETE FROM main WHERE report_id = ? AND parameter_id IN ({derived_placeholders})",
+            (report_id, *DERIVED_PARAMS)
+        )
+        conn.executemany(
+            "INSERT INTO main (report_id, parameter_id, value, flagged) VALUES (?, ?, ?, ?)",
+            [(report_id, param, value, 0) for param, value in derive_values(inputs).items()]
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO derived_inputs (report_id, inputs) VALUES (?, ?)",
+            (report_id, signature)
+        )
+        updated += 1
+    conn.commit()
+    return updated
+
+def load_database(target_path, files, rebuild=False):
+    """
+    Loads the given (report_type, path) pairs into the SQLite file at
+    `target_path`. The work is done on an in-memory copy which is written
+    back in one go. With `rebuild` the existing file contents are dropped.
+    """
+    ram_conn = sql.connect(":memory:")
+    if not rebuild and os.path.exists(target_path):
+        # --- Load disk → RAM ---
+        disk_conn = sql.connect(target_path)
+        disk_conn.backup(ram_conn)
+        disk_conn.close()
+
+    create_tables(ram_conn)
+    for report_type, file_pth in files:
+        insert_file(ram_conn, file_pth, report_type)
     ram_conn.commit()
+    update_derived_fields(ram_conn)
+
+    # --- Write RAM → disk ---
+    disk_conn = sql.connect(target_path)
+    ram_conn.backup(disk_conn)
+    disk_conn.close()
+    ram_conn.close()
+    return target_path, len(files)
+
+def shard_path(shard_by, key):
+    # Each scheme has its own directory so the read layer never mixes them.
+    return os.path.join(shards_dir, shard_by, f"{key}.db")
 
+def load_shards(shard_by, report_types=None, only=None, workers=None):
+    """
+    Partitions the JSONs by `report_type` or `sedar_year` and loads each
+    partition into its own shard file in parallel. A shard is always rebuilt
+    from scratch, so reloading one year only rewrites that year's file.
+    """
+    files = find_json_files(report_types)
+    os.makedirs(os.path.join(shards_dir, shard_by), exist_ok=True)
 
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if shard_by == 'sedar_year':
+            keys = pool.map(read_sedar_year, [pth for _, pth in files], chunksize=32)
+        else:
+            keys = [report_type for report_type, _ in files]
 
+        partitions = defaultdict(list)
+        for key, item in zip(keys, files):
+            partitions[key].append(item)
+        if only:
+            partitions = {k: v for k, v in partitions.items() if k in only}
 
-parse_params(json_to_parse)
-parse_files(JSON_DIR)
-insert_data(JSON_DIR)
+        futures = [
+            pool.submit(load_database, shard_path(shard_by, key), part, True)
+            for key, part in sorted(partitions.items())
+        ]
+        for future in futures:
+            target_path, count = future.result()
+            print(f"Loaded {count} reports into {target_path}")
 
 
-# --- Write RAM → disk ---
-disk_conn = sql.connect(db_file_path)
-ram_conn.backup(disk_conn)
-disk_conn.close()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load extraction JSONs into SQLite.")
+    parser.add_argument('--shard-by', choices=['report_type', 'sedar_year'],
+                        help="Write one shard file per report type or SEDAR year instead of database.db.")
+    parser.add_argument('--report-types', nargs='+', default=None,
+                        help="Report types to load (default: lhir, or all types when sharding).")
+    parser.add_argument('--only', nargs='+', default=None,
+                        help="Only (re)load these shard keys, e.g. --only 2024.")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
 
-# --- Verify ---
-disk_conn = sql.connect(db_file_path)
-print("\nData in DISK DB:")
-for row in disk_conn.execute("SELECT * FROM parameters;"):
-    print(row)
-for row in disk_conn.execute("SELECT * FROM reports;"):
-    print(row)
-disk_conn.close()
+    if args.shard_by:
+        load_shards(args.shard_by, args.report_types, args.only, args.workers)
+    else:
+        json_files = find_json_files(args.report_types or ['lhir'])
+        load_database(db_file_path, json_files)
 
-ram_conn.close()
+        # --- Verify ---
+        disk_conn = sql.connect(db_file_path)
+        print("\nData in DISK DB:")
+        for row in disk_conn.execute("SELECT * FROM parameters;"):
+            print(row)
+        for row in disk_conn.execute("SELECT * FROM reports;"):
+            print(row)
+        disk_conn.close()
@@ -1,53 +1,12 @@
-import sqlite3 as sql
 import pandas as pd
-import json
 import os
 import contextlib
+from helpers import datahelp
 pd.set_option('display.max_rows', None)
 pd.set_option('display.max_columns', None)
 pd.set_option('display.width', 1000) 
 pd.set_option('display.max_colwidth', None) 
 
-def create_pandas_df(conn):
-    """
-    Creates a wide-format Pandas DataFrame from the database.
-    Each row represents a report and each column a parameter.
-    """
-    sql_query = "SELECT report_id, parameter_id, value FROM main"
-    long_df = pd.read_sql_query(sql_query, conn)
-
-    if long_df.empty:
-        return pd.DataFrame()
-
-    wide_df = long_df.pivot(index='report_id', columns='parameter_id', values='value')
-    wide_df = wide_df.reset_index()
-    wide_df.columns.name = None
-
-    def cast_value(val):
-        if isinstance(val, str):
-            try:
-                # Attempt to load as JSON, which handles lists/dicts
-                return json.loads(val)
-            except json.JSONDecodeError:
-                # If it's not JSON, it's just a regular string
-                return val
-        # Return all other types (numbers, None, etc.) as they are
-        return val
-
-    for col in wide_df.columns:
-        if col != 'report_id':
-            # First, cast JSON strings back to Python objects (e.g., lists)
-            series = wide_df[col].map(cast_value)
-            
-            # Next, convert strings that represent numbers into numeric types.
-            # The 'ignore' flag ensures that actual strings or lists are not affected.
-            wide_df[col] = pd.to_numeric(series, errors='ignore')
-
-    return wide_df
-
-
-
-
 # --- Main Execution ---
 print("Starting script...")
 # Define paths
@@ -60,9 +19,9 @@ report_file_path = os.path.join(reports_dir, 'analysis_report.txt')
 # Create the reports directory if it doesn't exist
 os.makedirs(reports_dir, exist_ok=True)
 
-conn = sql.connect(db_pth)
-print("Connected to db.")
-master_data = create_pandas_df(conn)
+# Reads through datahelp's shared read-only connection and query cache.
+master_data = datahelp.create_pandas_df(db_path=db_pth)
+print("Loaded data from db.")
 
 if not master_data.empty:
     print(f"DataFrame created successfully with {len(master_data)} rows.")
@@ -136,5 +95,4 @@ if not master_data.empty:
 else:
     print("Master DataFrame is empty. No analysis to perform.")
 
-conn.close()
-print("Database connection closed. Script finished.")
\ No newline at end of file
+print("Script finished.")
\ No newline at end of file
@@ -1,13 +1,29 @@
 import pandas as pd
+import numpy as np
 import json  
+import os
+import re
+import glob
+import shutil
+import threading
+import sqlite3 as sql
+from collections import defaultdict, OrderedDict
+from urllib.request import pathname2url
+from helpers import derived
 
-def create_pandas_df(conn):
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'db', 'database.db')
+
+def create_pandas_df(conn=None, db_path=DEFAULT_DB_PATH):
     """
     Creates a wide-format Pandas DataFrame from the database.
     Each row represents a report and each column a parameter.
+    Without `conn` the query goes through the `query_to_df` cache.
     """
     sql_query = "SELECT report_id, parameter_id, value FROM main"
-    long_df = pd.read_sql_query(sql_query, conn)
+    if conn is None:
+        long_df = query_to_df(sql_query, db_path=db_path)
+    else:
+        long_df = pd.read_sql_query(sql_query, conn)
 
     if long_df.empty:
         return pd.DataFrame()
@@ -20,7 +36,7 @@ def create_pandas_df(conn):
         if isinstance(val, str):
             try:
                 return json.loads(val)
-            except json.JSONDecodeError:
+            except (json.JSONDecodeError, TypeError):
                 return val
         return val
 
@@ -33,13 +49,481 @@ def create_pandas_df(conn):
 
     return wide_df
 
+def _attach_shards(conn, shard_files):
+    schemas = []
+    for i, shard in enumerate(shard_files):
+        schema = f"shard_{i}"
+        uri = "file:" + pathname2url(os.path.abspath(shard)) + "?mode=ro"
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (uri,))
+        schemas.append(schema)
+    return schemas
+
+def _union_all(schemas, table):
+    return " UNION ALL ".join(f"SELECT * FROM {schema}.{table}" for schema in schemas)
+
+# Parameters are shared across shards, so keep one row per id.
+SHARD_PARAMETERS_SQL = (
+    "SELECT parameter_id, MAX(parameter_desc) AS parameter_desc, MAX(conf_upper) AS conf_upper, "
+    "MAX(conf_lower) AS conf_lower, MAX(prob_correct) AS prob_correct, "
+    "MAX(samples_checked) AS samples_checked FROM ({source}) GROUP BY parameter_id"
+)
+
+def connect_shards(shards_dir, shard_by):
+    """
+    Opens the shards written by `load_all_data.py --shard-by <shard_by>` and
+    exposes them as `main`, `reports` and `parameters`, so existing queries
+    run unchanged across all shards.
+
+    SQLite can only attach a limited number of databases (10 by default). Up
+    to that many shards are attached read-only behind TEMP views; beyond it
+    the shards are copied batch by batch into in-memory TEMP tables.
+    """
+    scheme_dir = os.path.join(shards_dir, shard_by)
+    shard_files = sorted(glob.glob(os.path.join(scheme_dir, '*.db')))
+    if not shard_files:
+        raise FileNotFoundError(f"No shard databases found in {scheme_dir}")
+
+    conn = sql.connect("file::memory:", uri=True)
+    limit = conn.getlimit(sql.SQLITE_LIMIT_ATTACHED)
+
+    if len(shard_files) <= limit:
+        schemas = _attach_shards(conn, shard_files)
+        for table in ("main", "reports"):
+            conn.execute(f"CREATE TEMP VIEW {table} AS {_union_all(schemas, table)}")
+        conn.execute(
+            "CREATE TEMP VIEW parameters AS "
+            + SHARD_PARAMETERS_SQL.format(source=_union_all(schemas, "parameters"))
+        )
+        return conn
+
+    for start in range(0, len(shard_files), limit):
+        schemas = _attach_shards(conn, shard_files[start:start + limit])
+        for table, target in (("main", "main"), ("reports", "reports"), ("parameters", "all_parameters")):
+            if start == 0:
+                conn.execute(f"CREATE TEMP TABLE {target} AS SELECT * FROM {schemas[0]}.{table} WHERE 0")
+            conn.execute(f"INSERT INTO temp.{target} {_union_all(schemas, table)}")
+        # ATTACH and DETACH are not allowed inside a transaction.
+        conn.commit()
+        for schema in schemas:
+            conn.execute(f"DETACH DATABASE {schema}")
+
+    conn.execute(
+        "CREATE TEMP TABLE parameters AS "
+        + SHARD_PARAMETERS_SQL.format(source="SELECT * FROM temp.all_parameters")
+    )
+    conn.execute("DROP TABLE temp.all_parameters")
+    conn.commit()
+    return conn
+
+# Approximate annual average USD per unit of currency. Only used when a
+# report does not state its own exchange rate.
+FALLBACK_USD_RATES = pd.DataFrame(
+    [
+        (f"{year}-01-01", currency, rate)
+        for currency, rates in {
+            'CAD': [0.673, 0.646, 0.637, 0.716, 0.770, 0.826, 0.882, 0.935, 0.943, 0.880, 0.971, 1.011, 1.001,
+                    0.971, 0.906, 0.783, 0.755, 0.771, 0.772, 0.754, 0.746, 0.798, 0.769, 0.741, 0.730],
+            'AUD': [0.582, 0.517, 0.544, 0.652, 0.736, 0.763, 0.753, 0.839, 0.855, 0.793, 0.920, 1.033, 1.036,
+                    0.968, 0.903, 0.752, 0.744, 0.767, 0.748, 0.695, 0.691, 0.751, 0.694, 0.664, 0.660],
+        }.items()
+        for year, rate in zip(range(2000, 2025), rates)
+    ],
+    columns=['date', 'currency', 'usd_per_unit'],
+)
+
+# Per-report exchange rate columns, in USD per unit of currency.
+REPORT_RATE_COLUMNS = {
+    'CAD': 'cad_usd_exchange_rate',
+    'AUD': 'aud_usd_exchange_rate',
+}
+
+# Monetary parameter patterns and the currency columns to look at for each,
+# most specific first. `main_currency` is always the last resort.
+MONETARY_CURRENCY_RULES = [
+    (r'^(?P<g>.+_cost)_dollars_per_t_\w+$', ['{g}_currency', 'opex_currency']),
+    (r'^(?P<g>(pre|after)_tax_npv_\d+)_in_millions$', ['{g}_currency']),
+    (r'^initial_capex_in_millions$', ['initial_capex_currency', 'capex_currency']),
+    (r'^(?P<g>[a-z]+_price)$', ['{g}_currency', 'commodity_price_currency']),
+]
+
+def parse_effective_date(series):
+    """
+    Parses effective dates with the loader's parser, so the data layer and
+    the stored `effective_date_parsed` never disagree. Each distinct string
+    is parsed once.
+    """
+    parsed = {}
+    for value in series.dropna().unique():
+        parsed_date = derived.parse_date(value)
+        parsed[value] = parsed_date.isoformat() if parsed_date else None
+    return pd.to_datetime(series.map(parsed), format='%Y-%m-%d', errors='coerce')
+
+def add_derived_fields(df):
+    """
+    Fills in the loader's derived parameters for frames read from databases
+    that predate them. Columns that are already present are left alone.
+    """
+    missing = [param for param in derived.DERIVED_PARAMS if param not in df.columns]
+    if not missing:
+        return df
+
+    inputs = df.reindex(columns=derived.DERIVED_INPUTS)
+    rows = [
+        derived.derive_values({k: v for k, v in row.items() if not pd.isna(v)})
+        for row in inputs.to_dict('records')
+    ]
+    values = pd.DataFrame(rows, index=df.index, columns=list(derived.DERIVED_PARAMS))
+    df = df.copy()
+    for param in missing:
+        df[param] = values[param]
+    return df
+
+def currency_codes(labels, df):
+    """
+    Maps currency labels like 'CAD (Canadian dollars)' to ISO codes.
+    'other' is read as AUD when the report gives an AUD exchange rate.
+    """
+    labels = labels.astype('string').str.strip()
+    codes = labels.str.extract(r'^(USD|CAD|AUD)\b', expand=False)
+    if REPORT_RATE_COLUMNS['AUD'] in df.columns:
+        has_aud = pd.to_numeric(df[REPORT_RATE_COLUMNS['AUD']], errors='coerce').notna()
+        codes = codes.mask(labels.str.startswith('other', na=False) & has_aud, 'AUD')
+    return codes
+
+def usd_rates(df, rate_table=None):
+    """
+    Returns a DataFrame of USD per unit for each report and currency, taken
+    from the report's own exchange rates and falling back to `rate_table`
+    keyed by effective date.
+    """
+    if rate_table is None:
+        rate_table = FALLBACK_USD_RATES
+    if 'effective_date_parsed' in df.columns:
+        # Precomputed ISO dates from the loader's derived fields.
+        dates = pd.to_datetime(df['effective_date_parsed'], format='%Y-%m-%d', errors='coerce').to_numpy(dtype='datetime64[ns]')
+    elif 'effective_date' in df.columns:
+        dates = parse_effective_date(df['effective_date']).to_numpy(dtype='datetime64[ns]')
+    else:
+        dates = np.full(len(df), np.datetime64('NaT'), dtype='datetime64[ns]')
+
+    rates = pd.DataFrame({'USD': 1.0}, index=df.index)
+    for currency in rate_table['currency'].unique():
+        table = rate_table[rate_table['currency'] == currency].sort_values('date')
+        table_dates = pd.to_datetime(table['date']).to_numpy(dtype='datetime64[ns]')
+        pos = np.searchsorted(table_dates, dates, side='right') - 1
+        fallback = np.where((pos >= 0) & ~np.isnat(dates), table['usd_per_unit'].to_numpy()[pos.clip(0)], np.nan)
+
+        rate_col = REPORT_RATE_COLUMNS.get(currency)
+        reported = pd.to_numeric(df[rate_col], errors='coerce') if rate_col in df.columns else np.nan
+        rates[currency] = pd.Series(reported, index=df.index).fillna(pd.Series(fallback, index=df.index))
+    return rates
+
+def monetary_columns(df):
+    """
+    Returns {monetary column: [currency columns to try, in order]}.
+    Columns added by `normalize_currency` are not monetary inputs.
+    """
+    skip_cols = set(df.attrs.get('normalized_currency_columns', ()))
+    found = {}
+    for col in df.columns:
+        if col in skip_cols:
+            continue
+        for pattern, templates in MONETARY_CURRENCY_RULES:
+            match = re.match(pattern, col)
+            if match:
+                candidates = [t.format(**match.groupdict()) for t in templates] + ['main_currency']
+                found[col] = [c for c in candidates if c in df.columns]
+                break
+    return found
+
+def normalize_currency(df, target='USD', rate_table=None):
+    """
+    Adds a `<column>_<target>` column for every monetary parameter, converted
+    to `target` with each report's exchange rates. Values whose currency is
+    unknown or has no rate are left as NaN. The conversion is stored on the
+    frame, so calling it again with the same target is free; calling it with
+    another target replaces the previous derived columns.
+    """
+    if df.attrs.get('normalized_currency') == target:
+        return df
+
+    rates = usd_rates(df, rate_table)
+    if target not in rates.columns:
+        raise ValueError(f"No exchange rates available for '{target}'.")
+    target_rate = rates[target]
+    suffix = target.lower()
+
+    converted = {}
+    for col, currency_cols in monetary_columns(df).items():
+        codes = pd.Series(pd.NA, index=df.index, dtype='string')
+        for currency_col in currency_cols:
+            codes = codes.fillna(currency_codes(df[currency_col], df))
+
+        # Unknown codes are <NA>; they must match no currency and stay NaN.
+        source_rate = np.select(
+            [(codes == currency).fillna(False).to_numpy(dtype=bool) for currency in rates.columns],
+            [rates[currency].to_numpy(dtype=float) for currency in rates.columns],
+            default=np.nan,
+        )
+
+        values = pd.to_numeric(df[col], errors='coerce')
+        converted[f"{col}_{suffix}"] = values * source_rate / target_rate
+
+    previous = set(df.attrs.get('normalized_currency_columns', ())) | set(converted)
+    df = df.drop(columns=[c for c in previous if c in df.columns])
+    df = pd.concat([df, pd.DataFrame(converted, index=df.index)], axis=1)
+    df.attrs['normalized_currency'] = target
+    df.attrs['normalized_currency_columns'] = list(converted)
+    return df
+
 def save_to_csv(df, pth="dataframe.csv"):
     df.to_csv(pth, index=False )
 
+# Strings treated as missing when deciding whether a column is numeric.
+NULL_TOKENS = ('', 'N/A')
+
+def value_kind(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, (bool, int)):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if not isinstance(value, str):
+        return 'string'
+    text = value.strip()
+    if text in NULL_TOKENS:
+        return 'null'
+    if text.startswith('['):
+        try:
+            if isinstance(json.loads(text), list):
+                return 'list'
+        except json.JSONDecodeError:
+            pass
+    try:
+        float(text)
+        return 'float'
+    except ValueError:
+        return 'string'
+
+def infer_column_types(conn):
+    """
+    Scans `main` once and returns {parameter_id: type} where type is one of
+    'int', 'float', 'list' or 'string'. Numeric columns may contain
+    NULL_TOKENS, which are exported as nulls. Anything mixed is a string.
+    """
+    kinds = defaultdict(set)
+    for parameter_id, value in conn.execute("SELECT parameter_id, value FROM main"):
+        kinds[parameter_id].add(value_kind(value))
+
+    types = {}
+    for parameter_id, found in sorted(kinds.items()):
+        found.discard('null')
+        if found and found <= {'int'}:
+            types[parameter_id] = 'int'
+        elif found and found <= {'int', 'float'}:
+            types[parameter_id] = 'float'
+        elif found == {'list'}:
+            types[parameter_id] = 'list'
+        else:
+            types[parameter_id] = 'string'
+    return types
+
+def convert_value(value, kind):
+    if value is None:
+        return None
+    if kind == 'string':
+        return value if isinstance(value, str) else str(value)
+    if isinstance(value, str) and value.strip() in NULL_TOKENS:
+        return None
+    if kind == 'int':
+        return int(value)
+    if kind == 'float':
+        return float(value)
+    return [str(item) for item in json.loads(value)]
+
+def export_partitioned(conn, out_dir, partition_by='sedar_year', chunk_size=500):
+    """
+    Streams the wide dataset into Parquet files, one directory per value of
+    `partition_by` (`sedar_year` or `report_type`) in `<column>=<value>`
+    layout. Reports are pivoted `chunk_size` at a time and written as row
+    groups, so the full frame is never held in memory. Column types are
+    written to `_schema.json` next to the partitions. Partitions left in
+    `out_dir` by an earlier export are removed first. Requires pyarrow.
+    """
+    if partition_by not in ('sedar_year', 'report_type'):
+        raise ValueError(f"Cannot partition by '{partition_by}'.")
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {
+        'int': pa.int64(),
+        'float': pa.float64(),
+        'list': pa.list_(pa.string()),
+        'string': pa.string(),
+    }
+    column_types = infer_column_types(conn)
+    schema = pa.schema(
+        [('report_id', pa.string())]
+        + [(col, arrow_types[kind]) for col, kind in column_types.items()]
+    )
+
+    os.makedirs(out_dir, exist_ok=True)
+    # Hive-style readers pick up every `<column>=<value>` directory, so stale
+    # partitions from an earlier export (of either scheme) must not remain.
+    for old_dir in glob.glob(os.path.join(out_dir, '*=*')):
+        if os.path.isdir(old_dir):
+            shutil.rmtree(old_dir)
+
+    keys = [row[0] for row in conn.execute(f"SELECT DISTINCT {partition_by} FROM reports ORDER BY 1")]
+    partitions = {}
+    for key in keys:
+        report_ids = [row[0] for row in conn.execute(
+            f"SELECT report_id FROM reports WHERE {partition_by} IS ? ORDER BY report_id", (key,)
+        )]
+        label = str(key) if key is not None else 'unknown'
+        part_dir = os.path.join(out_dir, f"{partition_by}={label}")
+        os.makedirs(part_dir, exist_ok=True)
+        part_path = os.path.join(part_dir, 'part-0.parquet')
+
+        with pq.ParquetWriter(part_path, schema) as writer:
+            for start in range(0, len(report_ids), chunk_size):
+                chunk = report_ids[start:start + chunk_size]
+                positions = {rid: i for i, rid in enumerate(chunk)}
+                columns = {col: [None] * len(chunk) for col in column_types}
+                placeholders = ", ".join("?" for _ in chunk)
+                for report_id, parameter_id, value in conn.execute(
+                    f"SELECT report_id, parameter_id, value FROM main WHERE report_id IN ({placeholders})",
+                    chunk
+                ):
+                    columns[parameter_id][positions[report_id]] = convert_value(value, column_types[parameter_id])
+                columns['report_id'] = chunk
+                writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+        partitions[label] = {
+            'path': os.path.relpath(part_path, out_dir),
+            'rows': len(report_ids),
+        }
 
+    sidecar = {
+        'partition_by': partition_by,
+        'null_tokens': list(NULL_TOKENS),
+        'columns': {'report_id': 'string', **column_types},
+        'partitions': partitions,
+    }
+    with open(os.path.join(out_dir, '_schema.json'), 'w', encoding='utf-8') as f:
+        json.dump(sidecar, f, indent=2)
+    return sidecar
 
-def query_to_df(query):
+
+
+# Each thread gets its own read-only connection per database, so queries
+# from different threads run concurrently. The lock only guards the cache.
+CONNECTION_PRAGMAS = (
+    "PRAGMA query_only = 1",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA temp_store = MEMORY",
+)
+QUERY_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+_thread_state = threading.local()
+_generations = {}
+_query_cache = OrderedDict()
+_query_cache_bytes = 0
+_lock = threading.RLock()
+
+def get_connection(db_path=DEFAULT_DB_PATH):
+    """
+    Returns the calling thread's read-only connection for `db_path`, opening
+    and tuning it on first use. The connection belongs to that thread and
+    must not be handed to other threads.
+    """
+    db_path = os.path.abspath(db_path)
+    connections = _thread_state.__dict__.setdefault('connections', {})
+    conn = connections.get(db_path)
+    if conn is None:
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"Database not found: {db_path}")
+        uri = "file:" + pathname2url(db_path) + "?mode=ro"
+        conn = sql.connect(uri, uri=True)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        connections[db_path] = conn
+    return conn
+
+def database_version(conn, db_path):
+    """
+    Returns a value that changes whenever `db_path` is written to.
+
+    `PRAGMA data_version` is only comparable on one connection, so each
+    thread remembers the last value it saw and bumps a process-wide
+    generation when it changes. The file sizes and modification times cover
+    writes made before this thread's connection was opened.
     """
-    Creates a dataframe from an SQL query
+    version = conn.execute("PRAGMA data_version").fetchone()[0]
+    seen = _thread_state.__dict__.setdefault('versions', {})
+    files = []
+    for pth in (db_path, db_path + '-wal'):
+        try:
+            stat = os.stat(pth)
+            files.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            files.append(None)
+    with _lock:
+        if db_path in seen and seen[db_path] != version:
+            _generations[db_path] = _generations.get(db_path, 0) + 1
+        seen[db_path] = version
+        return (_generations.get(db_path, 0), tuple(files))
+
+def normalize_sql(query):
+    # Only the ends are trimmed: whitespace inside the query may belong to a
+    # string literal, so collapsing it could make different queries collide.
+    return query.strip().rstrip(";").rstrip()
+
+def params_key(params):
+    if isinstance(params, dict):
+        return tuple(sorted(params.items()))
+    return tuple(params)
+
+def clear_query_cache():
+    global _query_cache_bytes
+    with _lock:
+        _query_cache.clear()
+        _query_cache_bytes = 0
+
+def query_to_df(query, params=(), db_path=DEFAULT_DB_PATH):
     """
-    pass
\ No newline at end of file
+    Creates a dataframe from an SQL query.
+
+    `params` may be a sequence for `?` placeholders or a dict for `:name`
+    placeholders. Results are kept in an in-process LRU cache keyed by the
+    SQL text, the parameters and the database version, so a write to the
+    database makes older entries unreachable. The cache is bounded by
+    QUERY_CACHE_MAX_BYTES of DataFrame memory. Callers get a copy and may
+    modify it freely. The query itself runs outside the cache lock on the
+    calling thread's own connection.
+    """
+    global _query_cache_bytes
+    db_path = os.path.abspath(db_path)
+    conn = get_connection(db_path)
+    key = (db_path, normalize_sql(query), params_key(params), database_version(conn, db_path))
+
+    with _lock:
+        cached = _query_cache.get(key)
+        if cached is not None:
+            _query_cache.move_to_end(key)
+            return cached[0].copy()
+
+    df = pd.read_sql_query(query, conn, params=params if isinstance(params, dict) else tuple(params))
+
+    size = int(df.memory_usage(deep=True).sum())
+    with _lock:
+        # Another thread may have cached the same query in the meantime.
+        if size <= QUERY_CACHE_MAX_BYTES and key not in _query_cache:
+            _query_cache[key] = (df, size)
+            _query_cache_bytes += size
+            while _query_cache_bytes > QUERY_CACHE_MAX_BYTES:
+                _, (_, evicted_size) = _query_cache.popitem(last=False)
+                _query_cache_bytes -= evicted_size
+    return df.copy()
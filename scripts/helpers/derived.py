@@ -0,0 +1,55 @@
+from datetime import datetime, date
+
+# Derived parameters are computed once by db/db_scripts/load_all_data.py and
+# stored next to the raw ones. This module is the only place they are
+# defined, and it only uses the standard library so the loader can import it.
+
+# Raw parameters that derived parameters are computed from.
+DERIVED_INPUTS = ['effective_date', 'total_material_mined', 'life_of_mine']
+DERIVED_PARAMS = {
+    'effective_date_parsed': "Derived: effective_date as an ISO date (YYYY-MM-DD).",
+    'effective_year': "Derived: year of effective_date.",
+    'calculated_mining_rate_tpd': "Derived: total_material_mined / (life_of_mine * 365.25), tonnes per day.",
+}
+
+DAYS_PER_YEAR = 365.25
+
+def parse_date(value):
+    """
+    Parses an effective date such as 'Dec-31-2021' or '2021-12-31'.
+    Returns None for anything else.
+    """
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    try:
+        return datetime.strptime(value, '%b-%d-%Y').date()
+    except ValueError:
+        pass
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return None
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def derive_values(inputs):
+    """
+    Computes the derived parameters of one report from its raw inputs.
+    Parameters that cannot be computed are left out.
+    """
+    derived = {}
+    effective_date = parse_date(inputs.get('effective_date'))
+    if effective_date:
+        derived['effective_date_parsed'] = effective_date.isoformat()
+        derived['effective_year'] = effective_date.year
+
+    total_material = to_float(inputs.get('total_material_mined'))
+    lom = to_float(inputs.get('life_of_mine'))
+    if total_material is not None and lom:
+        derived['calculated_mining_rate_tpd'] = total_material / (lom * DAYS_PER_YEAR)
+    return derived
@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BackgroundPlots:
+    """
+    Renders report figures on a background thread while the text sections
+    are being written. Submit each plot as soon as its data is ready and call
+    `wait` where the report lists the saved files.
+
+    Plot functions must draw on their own `matplotlib.figure.Figure` rather
+    than through `pyplot`, whose global state is not thread safe. They should
+    return the path (or paths) they saved.
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="plots")
+        self._futures = []
+
+    def submit(self, name, fn, *args, **kwargs):
+        self._futures.append((name, self._executor.submit(fn, *args, **kwargs)))
+
+    def wait(self):
+        """
+        Blocks until every submitted plot is done and returns a list of
+        (name, result, error) tuples in submission order. A failed plot does
+        not stop the others; its exception is returned as `error`.
+        """
+        results = []
+        for name, future in self._futures:
+            try:
+                results.append((name, future.result(), None))
+            except Exception as e:
+                results.append((name, None, e))
+        self._futures = []
+        return results
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+from helpers import datahelp
+
+# Parameters used to judge how alike two open pit studies are. Monetary ones
+# are the USD columns from `datahelp.normalize_currency`, so reports are not
+# ranked by the currency they were written in.
+SIMILARITY_FEATURES = [
+    'stripping_ratio',
+    'open_pit_mining_cost_dollars_per_t_mined_or_moved_usd',
+    'processing_cost_dollars_per_t_milled_usd',
+    'processing_rate',
+    'life_of_mine',
+    'initial_capex_in_millions_usd',
+]
+
+
+class SimilarityIndex:
+    """
+    Nearest-neighbour index over standardized report parameters.
+
+    The feature matrix is coerced to numeric and z-scored once when the index
+    is built; queries then only do matrix products against it. Missing values
+    are skipped: two reports are compared on the features they both have, and
+    the distance is rescaled so reports with fewer shared features are not
+    artificially close.
+    """
+
+    def __init__(self, df, features=None, id_col='report_id', log_features=None):
+        if features is None:
+            features = SIMILARITY_FEATURES
+            # No-op when the frame is already normalized to USD.
+            df = datahelp.normalize_currency(df, target='USD')
+        self.features = [c for c in features if c in df.columns]
+        if not self.features:
+            raise ValueError("None of the similarity features are present in the DataFrame.")
+
+        values = df[self.features].apply(pd.to_numeric, errors='coerce')
+        # Rates, tonnages and capex span orders of magnitude, so they are
+        # compared on a log scale by default.
+        if log_features is None:
+            log_features = ['processing_rate', 'initial_capex_in_millions_usd']
+        for col in log_features:
+            if col in values.columns:
+                values[col] = np.log10(values[col].where(values[col] > 0))
+
+        matrix = values.to_numpy(dtype=float)
+        mean = np.nanmean(matrix, axis=0)
+        std = np.nanstd(matrix, axis=0)
+        std = np.where(np.isfinite(std) & (std > 0), std, 1.0)
+        matrix = (matrix - mean) / std
+
+        self.report_ids = df[id_col].to_numpy()
+        self.mask = np.isfinite(matrix)
+        self.matrix = np.where(self.mask, matrix, 0.0)
+        self.squared = self.matrix ** 2
+        self._positions = {rid: i for i, rid in enumerate(self.report_ids)}
+
+    def _weights(self, weights):
+        w = np.ones(len(self.features))
+        if weights:
+            unknown = set(weights) - set(self.features)
+            if unknown:
+                raise KeyError(f"Unknown similarity features: {sorted(unknown)}")
+            for col, weight in weights.items():
+                w[self.features.index(col)] = weight
+        return w
+
+    def distances(self, report_ids, weights=None, min_shared=1):
+        """
+        Returns a (len(report_ids), n_reports) array of weighted distances.
+        Pairs with fewer than `min_shared` features in common get an
+        infinite distance.
+        """
+        rows = [self._positions[rid] for rid in report_ids]
+        w = self._weights(weights)
+
+        q = self.matrix[rows]
+        q_mask = self.mask[rows].astype(float)
+        c_mask = self.mask.astype(float)
+
+        # Expand sum_f w_f * (q_f - c_f)^2 over features present in both
+        # rows. Missing entries are zero in `matrix`, so the cross term
+        # already ignores them.
+        sq = ((q ** 2) * w) @ c_mask.T + (q_mask * w) @ self.squared.T - 2 * (q * w) @ self.matrix.T
+        shared = (q_mask * w) @ c_mask.T
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dist = np.sqrt(np.clip(sq, 0, None) * w.sum() / shared)
+        dist[(shared <= 0) | (q_mask @ c_mask.T < min_shared)] = np.inf
+        return dist
+
+    def query(self, report_ids, k=10, weights=None, min_shared=3):
+        """
+        Finds the k most similar reports for one report id or a list of them.
+        Returns a long DataFrame with one row per (query, neighbour) pair.
+        """
+        if isinstance(report_ids, str):
+            report_ids = [report_ids]
+        missing = [rid for rid in report_ids if rid not in self._positions]
+        if missing:
+            raise KeyError(f"Reports not in similarity index: {missing}")
+
+        dist = self.distances(report_ids, weights, min_shared)
+        # A report is never its own neighbour.
+        dist[np.arange(len(report_ids)), [self._positions[rid] for rid in report_ids]] = np.inf
+
+        k = min(k, dist.shape[1] - 1)
+        if k <= 0:
+            return pd.DataFrame(columns=['query_report_id', 'rank', 'report_id', 'distance'])
+        top = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(dist, top, axis=1).argsort(axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_dist = np.take_along_axis(dist, top, axis=1)
+
+        result = pd.DataFrame({
+            'query_report_id': np.repeat(report_ids, k),
+            'rank': np.tile(np.arange(1, k + 1), len(report_ids)),
+            'report_id': self.report_ids[top.ravel()],
+            'distance': top_dist.ravel(),
+        })
+        return result[np.isfinite(result['distance'])].reset_index(drop=True)
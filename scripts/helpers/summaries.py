@@ -1,9 +1,9 @@
 import pandas as pd
 import os
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
 import numpy as np
-from tqdm import tqdm
+
+# Plotting dependencies are imported inside the plotting functions so that
+# text-only summaries do not pay for loading matplotlib and tqdm.
 
 def generate_numerical_summary(df: pd.DataFrame, column_name: str) -> str:
     if column_name not in df.columns:
@@ -72,6 +72,11 @@ def plot_numeric_histograms_to_pdf(
     cap_std=5,
     bins=100,
 ):
+    # Figures are drawn without pyplot so this can run on a BackgroundPlots thread.
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_pdf import PdfPages
+    from tqdm import tqdm
+
     os.makedirs(os.path.dirname(save_path), exist_ok=True)
 
     with PdfPages(save_path) as pdf:
@@ -85,7 +90,8 @@ def plot_numeric_histograms_to_pdf(
                 print(f"Skipping '{col}' (all values are null).")
                 continue
 
-            plt.figure(figsize=(8, 6))
+            fig = Figure(figsize=(8, 6))
+            ax = fig.subplots()
             plot_data = series
             title = f"Histogram of {col}"
 
@@ -102,7 +108,6 @@ def plot_numeric_histograms_to_pdf(
                 title = f"Histogram of {col} (data within {cap_std}σ of median)"
 
                 if removed_count > 0:
-                    ax = plt.gca()
                     ax.text(
                         0.95,
                         0.95,
@@ -114,14 +119,15 @@ def plot_numeric_histograms_to_pdf(
                         horizontalalignment="right",
                     )
 
-            plt.hist(plot_data, bins=bins, color="steelblue", edgecolor="black")
-            plt.title(title, fontsize=14)
-            plt.xlabel(col, fontsize=12)
-            plt.ylabel("Frequency", fontsize=12)
+            ax.hist(plot_data, bins=bins, color="steelblue", edgecolor="black")
+            ax.set_title(title, fontsize=14)
+            ax.set_xlabel(col, fontsize=12)
+            ax.set_ylabel("Frequency", fontsize=12)
 
             if log_scale:
-                plt.yscale("log")
+                ax.set_yscale("log")
+
+            ax.grid(True, linestyle="--", alpha=0.6)
+            pdf.savefig(fig)
 
-            plt.grid(True, linestyle="--", alpha=0.6)
-            pdf.savefig()
-            plt.close()
\ No newline at end of file
+    return save_path
\ No newline at end of file
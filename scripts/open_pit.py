@@ -1,50 +1,15 @@
-import sqlite3 as sql
 import pandas as pd
-import json
 import os
-import contextlib
-import numpy as np
+import argparse
 import re
-import matplotlib.pyplot as plt
-import seaborn as sns
+from helpers import datahelp
+from helpers.plotting import BackgroundPlots
 # --- PANDAS DISPLAY OPTIONS ---
 pd.set_option('display.max_rows', None)
 pd.set_option('display.max_columns', None)
 pd.set_option('display.width', 1000) 
 pd.set_option('display.max_colwidth', None) 
 
-def create_pandas_df(conn):
-    """
-    Creates a wide-format Pandas DataFrame from the database.
-    Each row represents a report and each column a parameter.
-    """
-    sql_query = "SELECT report_id, parameter_id, value FROM main"
-    long_df = pd.read_sql_query(sql_query, conn)
-
-    if long_df.empty:
-        return pd.DataFrame()
-
-    wide_df = long_df.pivot(index='report_id', columns='parameter_id', values='value')
-    wide_df = wide_df.reset_index()
-    wide_df.columns.name = None
-
-    def cast_value(val):
-        if isinstance(val, str):
-            try:
-                return json.loads(val)
-            except (json.JSONDecodeError, TypeError):
-                return val
-        return val
-
-    for col in wide_df.columns:
-        if col != 'report_id':
-            series = wide_df[col].map(cast_value)
-            # Using 'ignore' is safer for initial load to preserve text/lists.
-            # We will coerce specific columns to numeric later.
-            wide_df[col] = pd.to_numeric(series, errors='ignore')
-
-    return wide_df
-
 def process_and_analyze_deposits(df, report_file_handle):
     """
     Sub-function to intelligently process, collapse, and atomize deposit types.
@@ -85,7 +50,44 @@ def process_and_analyze_deposits(df, report_file_handle):
 
     return exploded_df
 
+def set_plot_theme():
+    import seaborn as sns
+    sns.set_theme(style="whitegrid")
+
+# The plot functions draw on their own Figure instead of pyplot so they can
+# run on the BackgroundPlots threads. matplotlib and seaborn are only
+# imported here, so text-only runs skip them.
+def plot_mining_rate_histogram(plot_data, save_path):
+    from matplotlib.figure import Figure
+    import seaborn as sns
+
+    fig = Figure(figsize=(12, 7))
+    ax = fig.subplots()
+    sns.histplot(plot_data, log_scale=True, kde=True, bins=50, ax=ax)
+    ax.set_title('Distribution of Calculated Mining Rate (Log Scale)', fontsize=16)
+    ax.set_xlabel('Tonnes Per Day (TPD)', fontsize=12)
+    ax.set_ylabel('Number of Mines', fontsize=12)
+    fig.savefig(save_path)
+    return save_path
+
+def plot_mining_rate_boxplot(plot_data, save_path):
+    from matplotlib.figure import Figure
+    import seaborn as sns
+
+    fig = Figure(figsize=(12, 7))
+    ax = fig.subplots()
+    sns.boxplot(x=plot_data, ax=ax)
+    ax.set_xscale('log')
+    ax.set_title('Box Plot of Calculated Mining Rate (Log Scale)', fontsize=16)
+    ax.set_xlabel('Tonnes Per Day (TPD)', fontsize=12)
+    fig.savefig(save_path)
+    return save_path
+
 # --- Main Execution ---
+parser = argparse.ArgumentParser(description="Open pit analysis report.")
+parser.add_argument('--no-plots', action='store_true', help="Only write the text report.")
+args = parser.parse_args()
+
 print("Starting script...")
 script_dir = os.path.dirname(os.path.abspath(__file__))
 db_dir = os.path.join(script_dir, '..', 'db') 
@@ -95,9 +97,9 @@ report_file_path = os.path.join(reports_dir, 'openpit_report.txt')
 
 os.makedirs(reports_dir, exist_ok=True)
 
-conn = sql.connect(db_pth)
-print("Connected to db.")
-master_data = create_pandas_df(conn)
+# Reads through datahelp's shared read-only connection and query cache.
+master_data = datahelp.create_pandas_df(db_path=db_pth)
+print("Loaded data from db.")
 
 if not master_data.empty:
     if 'mine_type' in master_data.columns:
@@ -112,15 +114,12 @@ if not master_data.empty:
         print(f"Generating Open Pit analysis report at: {report_file_path}")
 
         # --- Feature Engineering & Data Type Coercion ---
-        if 'total_material_mined' in open_pit_df and 'life_of_mine' in open_pit_df:
-            # Coerce inputs to numeric before calculation
-            total_material = pd.to_numeric(open_pit_df['total_material_mined'], errors='coerce')
-            lom = pd.to_numeric(open_pit_df['life_of_mine'], errors='coerce')
-            lom_in_days = lom * 365.25
-            open_pit_df['calculated_mining_rate_tpd'] = total_material / lom_in_days.replace(0, np.nan)
-
-        if 'effective_date' in open_pit_df:
-            open_pit_df['year'] = pd.to_datetime(open_pit_df['effective_date'], errors='coerce').dt.year
+        # Databases built by load_all_data.py already carry the mining rate
+        # and effective year as derived parameters; older ones get them here
+        # from the same helpers.derived code.
+        open_pit_df = datahelp.add_derived_fields(open_pit_df)
+        open_pit_df['calculated_mining_rate_tpd'] = pd.to_numeric(open_pit_df['calculated_mining_rate_tpd'], errors='coerce')
+        open_pit_df['year'] = pd.to_numeric(open_pit_df['effective_year'], errors='coerce')
 
         # ===================================================================
         # --- NEW SECTION: Force numeric types for key analysis columns ---
@@ -136,16 +135,30 @@ if not master_data.empty:
         for col in cols_to_make_numeric:
             if col in open_pit_df.columns:
                 open_pit_df[col] = pd.to_numeric(open_pit_df[col], errors='coerce')
+
+        # Costs are reported in CAD, AUD and USD; compare them in USD.
+        open_pit_df = datahelp.normalize_currency(open_pit_df, target='USD')
         # ===================================================================
 
-        with open(report_file_path, 'w', encoding='utf-8') as f:
+        with BackgroundPlots() as plots, open(report_file_path, 'w', encoding='utf-8') as f:
+            # Start the plots first so they render while the text sections are written.
+            plot_col = 'calculated_mining_rate_tpd'
+            has_plot_data = plot_col in open_pit_df.columns and open_pit_df[plot_col].notna().any()
+            if has_plot_data and not args.no_plots:
+                set_plot_theme()
+                plot_data = open_pit_df[plot_col].dropna()
+                plots.submit("histogram", plot_mining_rate_histogram, plot_data,
+                             os.path.join(reports_dir, 'mining_rate_histogram.png'))
+                plots.submit("box plot", plot_mining_rate_boxplot, plot_data,
+                             os.path.join(reports_dir, 'mining_rate_boxplot.png'))
+
             print(f"\nThis report is based on {len(open_pit_df)} studies with an open pit component.", file=f)
 
             print("\n" + "="*20 + " ADVANCED DEPOSIT TYPE ANALYSIS " + "="*20, file=f)
             exploded_deposit_df = process_and_analyze_deposits(open_pit_df, f)
 
             
-            cost_col = 'open_pit_mining_cost_dollars_per_t_mined_or_moved'
+            cost_col = 'open_pit_mining_cost_dollars_per_t_mined_or_moved_usd'
             
             if 'atomized_deposit_type' in exploded_deposit_df.columns and cost_col in exploded_deposit_df.columns:
                 # Ensure the cost column is numeric before processing
@@ -198,37 +211,19 @@ if not master_data.empty:
             # --- NEW VISUALIZATION SECTION ---
             # ===================================================================
             print("\n\n" + "="*20 + " DATA VISUALIZATIONS " + "="*20, file=f)
-            print("The following plots have been generated and saved to the 'reports' directory.", file=f)
-            
-            sns.set_theme(style="whitegrid")
-            
-            plot_col = 'calculated_mining_rate_tpd'
-            if plot_col in open_pit_df.columns and open_pit_df[plot_col].notna().any():
-                plot_data = open_pit_df[plot_col].dropna()
 
-                # --- Histogram ---
-                plt.figure(figsize=(12, 7))
-                sns.histplot(plot_data, log_scale=True, kde=True, bins=50)
-                plt.title('Distribution of Calculated Mining Rate (Log Scale)', fontsize=16)
-                plt.xlabel('Tonnes Per Day (TPD)', fontsize=12)
-                plt.ylabel('Number of Mines', fontsize=12)
-                histogram_path = os.path.join(reports_dir, 'mining_rate_histogram.png')
-                plt.savefig(histogram_path)
-                plt.close() # Close the figure to free memory
-                print(f"\n- Distribution histogram saved to: {os.path.basename(histogram_path)}", file=f)
-
-                # --- Box Plot ---
-                plt.figure(figsize=(12, 7))
-                sns.boxplot(x=plot_data)
-                plt.xscale('log')
-                plt.title('Box Plot of Calculated Mining Rate (Log Scale)', fontsize=16)
-                plt.xlabel('Tonnes Per Day (TPD)', fontsize=12)
-                boxplot_path = os.path.join(reports_dir, 'mining_rate_boxplot.png')
-                plt.savefig(boxplot_path)
-                plt.close() # Close the figure to free memory
-                print(f"- Distribution box plot saved to: {os.path.basename(boxplot_path)}", file=f)
-                
+            if args.no_plots:
+                print("Plots were skipped for this run (--no-plots).", file=f)
+            elif has_plot_data:
+                print("The following plots have been generated and saved to the 'reports' directory.", file=f)
+                print("", file=f)
+                for name, path, error in plots.wait():
+                    if error is not None:
+                        print(f"- Could not generate distribution {name}: {error}", file=f)
+                    else:
+                        print(f"- Distribution {name} saved to: {os.path.basename(path)}", file=f)
             else:
+                print("The following plots have been generated and saved to the 'reports' directory.", file=f)
                 print("\n- Could not generate plots for Mining Rate: No data available.", file=f)
             # ===================================================================
 
@@ -243,5 +238,4 @@ if not master_data.empty:
 else:
     print("Master DataFrame is empty. No analysis to perform.")
 
-conn.close()
-print("\nDatabase connection closed. Script finished.")
\ No newline at end of file
+print("\nScript finished.")
\ No newline at end of file
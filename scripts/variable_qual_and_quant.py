@@ -1,14 +1,21 @@
 from helpers import exploder, datahelp, summaries
-import matplotlib.pyplot as plt
+from helpers.plotting import BackgroundPlots
+import argparse
 import pandas as pd
 import os
 
+parser = argparse.ArgumentParser(description="Overall summary of every parameter.")
+parser.add_argument('--no-plots', action='store_true', help="Only write the text summary.")
+args = parser.parse_args()
+
 pd.set_option('display.max_rows', None)
 pd.set_option('display.max_columns', None)
 pd.set_option('display.width', 1000) 
 pd.set_option('display.max_colwidth', None) 
 
 df = pd.read_csv("dataframe.csv")
+# The CSV may predate the loader's derived parameters; fill them in.
+df = datahelp.add_derived_fields(df)
 
 
 # Theese columns are lists that need to be cleaned
@@ -41,6 +48,8 @@ cols_to_make_numeric = [
     'total_ore_mined',
     'total_waste_mined',
     'total_material_mined',
+    'calculated_mining_rate_tpd',
+    'effective_year',
 
     # Metals
     'copper_price',
@@ -83,43 +92,56 @@ cols_to_make_numeric = [
 ]
 excluded_cols = [
     "report_id", "subdivision", "lat", "long", "author_company","company_name", "effective_date",
-    "project_name"
+    "effective_date_parsed", "project_name"
 ]
 
 
-report_parts = []
-
 for col in cols_to_make_numeric:
     if col in df.columns:
         df[col] = pd.to_numeric(df[col], errors='coerce')
 
-print("--- Generating Numerical Summaries ---")
-for col in cols_to_make_numeric:
-    print(f"Analyzing: {col}...")
-    report_parts.append(summaries.generate_numerical_summary(df, col))
 
-print("\n--- Generating Qualitative Summaries ---")
-for col in [c for c in df.columns if c not in cols_to_make_numeric and c not in excluded_cols]:
-    try:
-        print(f"Analyzing: {col}...")
-        report_parts.append(summaries.generate_qualitative_summary(df, col))
-    except Exception as e:
-        print(f"  > AN EXCEPTION OCCURRED while processing column: '{col}'. Error: {e}")
+def write_text_report():
+    report_parts = []
 
-for col in excluded_cols:
-    try:
+    print("--- Generating Numerical Summaries ---")
+    for col in cols_to_make_numeric:
         print(f"Analyzing: {col}...")
-        report_parts.append(summaries.generate_null_summary(df, col))
-    except Exception as e:
-        print(f"  > AN EXCEPTION OCCURRED while processing column: '{col}'. Error: {e}")
-
-full_report = "".join(report_parts)
-with open("../reports/overall_summary/overall_summary.txt", "w", encoding="utf-8") as f:
-    f.write("      DataFrame Overall Summary Report     \n")
-    f.write("../reports/overall_summary.txt")
-    f.write(full_report)
-
-
-# Numerical plots
-pth = "../reports/overall_summary/numeric_plots.pdf"
-summaries.plot_numeric_histograms_to_pdf(df,cols_to_make_numeric, pth)
\ No newline at end of file
+        report_parts.append(summaries.generate_numerical_summary(df, col))
+
+    print("\n--- Generating Qualitative Summaries ---")
+    for col in [c for c in df.columns if c not in cols_to_make_numeric and c not in excluded_cols]:
+        try:
+            print(f"Analyzing: {col}...")
+            report_parts.append(summaries.generate_qualitative_summary(df, col))
+        except Exception as e:
+            print(f"  > AN EXCEPTION OCCURRED while processing column: '{col}'. Error: {e}")
+
+    for col in excluded_cols:
+        try:
+            print(f"Analyzing: {col}...")
+            report_parts.append(summaries.generate_null_summary(df, col))
+        except Exception as e:
+            print(f"  > AN EXCEPTION OCCURRED while processing column: '{col}'. Error: {e}")
+
+    full_report = "".join(report_parts)
+    with open("../reports/overall_summary/overall_summary.txt", "w", encoding="utf-8") as f:
+        f.write("      DataFrame Overall Summary Report     \n")
+        f.write("../reports/overall_summary.txt")
+        f.write(full_report)
+
+
+if args.no_plots:
+    write_text_report()
+else:
+    # Numerical plots render in the background while the text summary is built.
+    with BackgroundPlots(max_workers=1) as plots:
+        pth = "../reports/overall_summary/numeric_plots.pdf"
+        plots.submit("numeric histograms", summaries.plot_numeric_histograms_to_pdf, df, cols_to_make_numeric, pth)
+        write_text_report()
+
+        for name, path, error in plots.wait():
+            if error is not None:
+                print(f"  > Could not generate {name}: {error}")
+            else:
+                print(f"Saved {name} to: {path}")